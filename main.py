@@ -1,57 +1,438 @@
 import os
-import json
-from datetime import datetime
-
-from fastapi import FastAPI, Request, HTTPException
-import psycopg2
-from psycopg2.extras import RealDictCursor
-
-app = FastAPI()
+import sys
+import hmac
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any
+
+import asyncpg
+import msgspec
+import orjson
+from cachetools import TTLCache
+from fastapi import Depends, FastAPI, Request, HTTPException
+from fastapi.responses import ORJSONResponse
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+)
+logger = logging.getLogger("kiwify")
 
 DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
 WEBHOOK_TOKEN = os.getenv("KIWIFY_WEBHOOK_TOKEN", "").strip()
+WEBHOOK_TOKEN_B = WEBHOOK_TOKEN.encode()
+
+# Workers do uvicorn (o próprio uvicorn lê WEB_CONCURRENCY como default de
+# --workers). O orçamento total de conexões com o banco, DB_MAX_CONNECTIONS,
+# é dividido entre eles: cada worker tem o seu pool. O default de 40 deixa
+# folga no max_connections=100 do Postgres.
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "2")))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "40"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", str(max(1, DB_MAX_CONNECTIONS // WEB_CONCURRENCY))))
+DB_POOL_MIN = min(int(os.getenv("DB_POOL_MIN", str(max(1, DB_POOL_MAX // 4)))), DB_POOL_MAX)
+
+# Atrás do PgBouncer em pool_mode=transaction não dá pra manter prepared
+# statements entre transações: nesse caso usar DB_STATEMENT_CACHE_SIZE=0.
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "1024"))
+
+# Cache do /status por email. A assinatura só muda via webhook (que invalida a
+# entrada). Com REDIS_URL o cache é compartilhado entre workers; sem ele cada
+# worker tem o seu (STATUS_CACHE) e vale o TTL.
+REDIS_URL = os.getenv("REDIS_URL", "").strip()
+# Redis travado não pode segurar o /status: estourou o timeout, vira cache miss
+REDIS_TIMEOUT_SECS = float(os.getenv("REDIS_TIMEOUT_SECS", "0.25"))
+STATUS_CACHE_TTL = 60
+STATUS_CACHE = TTLCache(maxsize=100_000, ttl=STATUS_CACHE_TTL)
+
+# Limite de tamanho de um email (RFC 5321); acima disso nem consulta o banco
+MAX_EMAIL_LEN = 320
+
+# Fila da auditoria: o worker grava em lote a cada AUDIT_FLUSH_SECS ou
+# AUDIT_BATCH_SIZE eventos, o que vier primeiro.
+AUDIT_QUEUE_MAX = 10_000
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_SECS = 0.1
+# Falha no COPY: tenta de novo com backoff (0.5s, 1s, ...). O webhook já
+# respondeu 200, a Kiwify não reenvia.
+AUDIT_FLUSH_RETRIES = 3
+AUDIT_RETRY_BASE_SECS = 0.5
+# Teto por acquire/COPY/INSERT da auditoria: com o banco fora o worker (e o
+# shutdown) não fica preso no command_timeout de 60s
+AUDIT_DB_TIMEOUT_SECS = 5
 
 
 # =========================
 # DATABASE
 # =========================
-def get_conn():
+# O schema fica em migrations/*.sql e roda uma vez no deploy, antes do uvicorn:
+# o start.sh (comando de start do deploy) chama `python main.py migrate` e só
+# depois sobe a API. Os workers não rodam DDL.
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# Chave do advisory lock do migrate (qualquer bigint fixo serve)
+MIGRATE_LOCK_ID = 4_242_001
+# Primeira linha das migrations que não podem rodar dentro de transação
+MIGRATE_NO_TX_MARKER = "-- migrate: no-transaction"
+MIGRATIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name TEXT PRIMARY KEY,
+        applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+# Queries do hot path ficam em constantes: o asyncpg guarda o prepared
+# statement por conexão (chave = texto do SQL), então cada query só passa
+# pelo Parse/plan uma vez por conexão.
+STATUS_SQL = "SELECT email, active, updated_at FROM subscriptions WHERE email=$1"
+
+AUDIT_SQL = "INSERT INTO webhook_events (event, email, raw) VALUES ($1, $2, $3)"
+
+AUDIT_COLUMNS = ["event", "email", "raw"]
+
+# Auditoria + upsert da assinatura num único statement (um round-trip, atômico)
+AUDIT_UPSERT_SQL = """
+    WITH audit AS (
+        INSERT INTO webhook_events (event, email, raw) VALUES ($1, $2, $3::jsonb)
+    )
+    INSERT INTO subscriptions (email, active, updated_at)
+    VALUES ($2, $4, NOW() AT TIME ZONE 'UTC')
+    ON CONFLICT (email)
+    DO UPDATE SET active=EXCLUDED.active, updated_at=EXCLUDED.updated_at
+"""
+
+
+# JSONB no formato binário: 1 byte de versão + o JSON em UTF-8. Com o orjson
+# dá pra passar o dict direto como parâmetro, sem json.dumps -> str -> bytes;
+# bytes são tratados como JSON já serializado (ex: body cru do webhook).
+def _jsonb_encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return b"\x01" + value
+    return b"\x01" + orjson.dumps(value)
+
+
+def _jsonb_decode(data: bytes):
+    return orjson.loads(data[1:])
+
+
+async def _init_conn(conn):
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=_jsonb_encode,
+        decoder=_jsonb_decode,
+        schema="pg_catalog",
+        format="binary",
+    )
+
+
+async def create_pool():
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL não configurado.")
-    return psycopg2.connect(DATABASE_URL, sslmode="require")
+    return await asyncpg.create_pool(
+        dsn=DATABASE_URL,
+        min_size=DB_POOL_MIN,
+        max_size=DB_POOL_MAX,
+        ssl="require",
+        command_timeout=60,
+        max_inactive_connection_lifetime=300,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        init=_init_conn,
+    )
+
+
+def _split_sql(sql: str) -> list:
+    """
+    Quebra um .sql em statements pelo `;`. Simples de propósito: só serve pra
+    migrations sem `;` dentro de string/corpo de função (ex: CREATE INDEX).
+    """
+    lines = [l for l in sql.splitlines() if not l.lstrip().startswith("--")]
+    return [st.strip() for st in "\n".join(lines).split(";") if st.strip()]
+
+
+async def migrate():
+    """
+    Aplica migrations/*.sql em ordem de nome, cada uma numa transação junto
+    com o registro em schema_migrations; as já registradas são puladas. Segura
+    um advisory lock durante a execução: dois deploys simultâneos não migram
+    ao mesmo tempo, o segundo espera e depois só encontra o que já foi aplicado.
+
+    Arquivo que começa com MIGRATE_NO_TX_MARKER (ex: CREATE INDEX
+    CONCURRENTLY) roda statement por statement, fora de transação.
+    """
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL não configurado.")
+
+    conn = await asyncpg.connect(dsn=DATABASE_URL, ssl="require")
+    try:
+        # try_lock em loop em vez de pg_advisory_lock: quem espera não fica com
+        # uma transação aberta no banco enquanto a outra instância migra
+        while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATE_LOCK_ID):
+            logger.info("[MIGRATE] Outra instância migrando, aguardando...")
+            await asyncio.sleep(1)
+        try:
+            await conn.execute(MIGRATIONS_TABLE_SQL)
+            applied = {r["name"] for r in await conn.fetch("SELECT name FROM schema_migrations")}
+            for name in sorted(os.listdir(MIGRATIONS_DIR)):
+                if not name.endswith(".sql") or name in applied:
+                    continue
+                with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+                    sql = f.read()
+                if sql.startswith(MIGRATE_NO_TX_MARKER):
+                    # Statement por statement, fora de transação: um script com
+                    # vários statements vira uma transação implícita no Postgres
+                    for statement in _split_sql(sql):
+                        await conn.execute(statement)
+                    await conn.execute("INSERT INTO schema_migrations (name) VALUES ($1)", name)
+                else:
+                    async with conn.transaction():
+                        await conn.execute(sql)
+                        await conn.execute("INSERT INTO schema_migrations (name) VALUES ($1)", name)
+                logger.info("[MIGRATE] %s aplicada", name)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATE_LOCK_ID)
+    finally:
+        await conn.close()
+
+
+async def warm_pool(pool, n: int):
+    """
+    O create_pool já abre as `min_size` conexões; o que ainda fica pro
+    primeiro request é o Parse da query do /status em cada conexão. Roda a
+    query uma vez em `n` conexões em paralelo pra ela já cair no cache.
+    """
+    async def one():
+        async with pool.acquire() as conn:
+            await conn.fetchrow(STATUS_SQL, "")
+
+    await asyncio.gather(*[one() for _ in range(n)])
+
+
+async def db():
+    """
+    Conexão do pool com escopo de request: só é adquirida no primeiro
+    `await get_conn()` (cache hit no /status nem toca o pool) e é a mesma pra
+    tudo que rodar no request. Volta pro pool no fim do request.
+    """
+    conn = None
+
+    async def get_conn():
+        nonlocal conn
+        if conn is None:
+            conn = await app.state.pool.acquire()
+        return conn
+
+    try:
+        yield get_conn
+    finally:
+        if conn is not None:
+            await app.state.pool.release(conn)
+
+
+# =========================
+# CACHE
+# =========================
+def _status_key(email: str) -> str:
+    return f"sub:{email}"
+
+
+async def cache_get(email: str):
+    redis = app.state.redis
+    if redis is None:
+        return STATUS_CACHE.get(email)
+
+    try:
+        cached = await redis.get(_status_key(email))
+    except RedisError as exc:
+        logger.warning("[CACHE] Redis get falhou: %r", exc)
+        return None
+    if cached is None:
+        return None
+
+    try:
+        return orjson.loads(cached)
+    except orjson.JSONDecodeError:
+        logger.warning("[CACHE] Valor inválido no Redis pra %s, ignorando", email)
+        return None
+
+
+async def cache_set(email: str, result: dict):
+    redis = app.state.redis
+    if redis is None:
+        STATUS_CACHE[email] = result
+        return
+
+    try:
+        await redis.set(_status_key(email), orjson.dumps(result), ex=STATUS_CACHE_TTL)
+    except RedisError as exc:
+        logger.warning("[CACHE] Redis set falhou: %r", exc)
+
+
+async def cache_drop(email: str):
+    redis = app.state.redis
+    if redis is None:
+        STATUS_CACHE.pop(email, None)
+        return
+
+    try:
+        await redis.delete(_status_key(email))
+    except RedisError as exc:
+        # Sem invalidar, o /status pode ficar velho até o TTL expirar
+        logger.error("[CACHE] Redis delete falhou (%s): %r", email, exc)
+
+
+# =========================
+# AUDIT
+# =========================
+# Erros do próprio dado (JSON/tipo inválido, constraint): repetir o COPY não
+# adianta, o lote vai linha a linha. Conexão/timeout não entram aqui.
+_AUDIT_ROW_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+
+async def _insert_audit(event: str, email: str, raw: bytes):
+    async with app.state.pool.acquire(timeout=AUDIT_DB_TIMEOUT_SECS) as conn:
+        await conn.execute(
+            AUDIT_SQL, event or None, email or None, raw, timeout=AUDIT_DB_TIMEOUT_SECS
+        )
+
+
+async def _insert_audit_rows(records: list):
+    # Uma linha ruim não leva as outras
+    for event, email, raw in records:
+        try:
+            await _insert_audit(event, email, raw)
+        except Exception as exc:
+            # Última chance de não perder o payload: vai inteiro pro log
+            logger.error(
+                "[AUDIT] Evento perdido (event=%s email=%s): %r | raw=%s",
+                event, email, exc, raw.decode(errors="replace"),
+            )
+
+
+async def _flush_audit(records: list) -> bool:
+    """
+    Grava o lote via COPY. Retorna False se o banco não respondeu depois das
+    tentativas: aí o lote não foi gravado e fica com quem chamou.
+    """
+    for attempt in range(1, AUDIT_FLUSH_RETRIES + 1):
+        try:
+            async with app.state.pool.acquire(timeout=AUDIT_DB_TIMEOUT_SECS) as conn:
+                await conn.copy_records_to_table(
+                    "webhook_events",
+                    records=records,
+                    columns=AUDIT_COLUMNS,
+                    timeout=AUDIT_DB_TIMEOUT_SECS,
+                )
+            return True
+        except _AUDIT_ROW_ERRORS as exc:
+            logger.warning(
+                "[AUDIT] COPY de %d eventos recusado (%r), gravando linha a linha",
+                len(records), exc,
+            )
+            await _insert_audit_rows(records)
+            return True
+        except Exception as exc:
+            logger.warning(
+                "[AUDIT] COPY de %d eventos falhou (tentativa %d/%d): %r",
+                len(records), attempt, AUDIT_FLUSH_RETRIES, exc,
+            )
+            if attempt < AUDIT_FLUSH_RETRIES:
+                await asyncio.sleep(AUDIT_RETRY_BASE_SECS * 2 ** (attempt - 1))
+    return False
 
 
-def init_db():
-    conn = get_conn()
+def _requeue_audit(queue: asyncio.Queue, records: list, stopping: bool):
+    """
+    Lote que o banco não aceitou volta pra fila e sai no próximo flush. No
+    shutdown (ou com a fila cheia) não tem próximo: loga uma vez e descarta.
+    """
+    dropped = records
+    if not stopping:
+        dropped = []
+        for record in records:
+            try:
+                queue.put_nowait(record)
+            except asyncio.QueueFull:
+                dropped.append(record)
+    if dropped:
+        logger.error(
+            "[AUDIT] Banco indisponível: %d eventos descartados: %s",
+            len(dropped), [(event, email) for event, email, _ in dropped],
+        )
+
+
+async def _audit_worker(queue: asyncio.Queue):
+    """
+    Drena a fila da auditoria e grava via COPY. Termina ao receber None,
+    depois de gravar o que já estava no lote.
+    """
+    loop = asyncio.get_running_loop()
+    stop = False
+    while not stop:
+        item = await queue.get()
+        if item is None:
+            break
+
+        records = [item]
+        deadline = loop.time() + AUDIT_FLUSH_SECS
+        while len(records) < AUDIT_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stop = True
+                break
+            records.append(item)
+
+        if not await _flush_audit(records):
+            _requeue_audit(queue, records, stop)
+
+    # Lote devolvido pra fila depois do None não foi visto pelo loop
+    records = []
+    while not queue.empty():
+        records.append(queue.get_nowait())
+    if records and not await _flush_audit(records):
+        _requeue_audit(queue, records, True)
+
+
+async def enqueue_audit(event: str, email: str, raw: bytes):
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS subscriptions (
-                    email TEXT PRIMARY KEY,
-                    active BOOLEAN NOT NULL DEFAULT FALSE,
-                    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
-                );
-            """)
-
-            # Auditoria dos webhooks pra debug
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS webhook_events (
-                    id SERIAL PRIMARY KEY,
-                    received_at TIMESTAMP NOT NULL DEFAULT NOW(),
-                    event TEXT,
-                    email TEXT,
-                    raw JSONB
-                );
-            """)
-
-            conn.commit()
+        app.state.audit_queue.put_nowait((event or None, email or None, raw))
+    except asyncio.QueueFull:
+        # Fila cheia: grava direto pra não perder o evento. Com o banco fora
+        # estoura em AUDIT_DB_TIMEOUT_SECS e o webhook responde 500
+        await _insert_audit(event, email, raw)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.redis = (
+        aioredis.Redis.from_url(
+            REDIS_URL,
+            socket_timeout=REDIS_TIMEOUT_SECS,
+            socket_connect_timeout=REDIS_TIMEOUT_SECS,
+        )
+        if REDIS_URL else None
+    )
+    app.state.pool = await create_pool()
+    await warm_pool(app.state.pool, DB_POOL_MIN)
+    app.state.audit_queue = asyncio.Queue(maxsize=AUDIT_QUEUE_MAX)
+    app.state.audit_task = asyncio.create_task(_audit_worker(app.state.audit_queue))
+    try:
+        yield
     finally:
-        conn.close()
+        await app.state.audit_queue.put(None)
+        await app.state.audit_task
+        await app.state.pool.close()
+        if app.state.redis is not None:
+            await app.state.redis.aclose()
 
 
-@app.on_event("startup")
-def startup():
-    init_db()
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 
 # =========================
@@ -62,38 +443,60 @@ def root():
     return {"LazyAndDark": "API ONLINE"}
 
 
+# Resposta pronta: o health check não re-serializa nada a cada chamada
+_HEALTH_RESPONSE = ORJSONResponse({"ok": True})
+
+
 @app.get("/health")
-def health():
-    return {"ok": True}
+async def health():
+    return _HEALTH_RESPONSE
 
 
 @app.get("/status")
-def status(email: str):
+async def status(email: str, get_conn=Depends(db)):
+    # Tamanho checado antes de normalizar: string gigante nem passa pelo
+    # strip/lower e não volta ecoada na resposta
+    if len(email) > MAX_EMAIL_LEN:
+        return {"email": "", "active": False, "found": False}
+
+    # Normalização fica no Python (igual ao pick_email): a mesma chave serve
+    # pro banco (TEXT) e pro cache
     email = email.strip().lower()
-    conn = get_conn()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                "SELECT email, active, updated_at FROM subscriptions WHERE email=%s",
-                (email,),
-            )
-            row = cur.fetchone()
-            if not row:
-                return {"email": email, "active": False, "found": False}
-
-            return {
-                "email": row["email"],
-                "active": bool(row["active"]),
-                "found": True,
-                "updated_at": str(row["updated_at"]),
-            }
-    finally:
-        conn.close()
+    if not email:
+        return {"email": "", "active": False, "found": False}
+
+    hit = await cache_get(email)
+    if hit is not None:
+        return hit
+
+    conn = await get_conn()
+    row = await conn.fetchrow(STATUS_SQL, email)
+
+    if not row:
+        result = {"email": email, "active": False, "found": False}
+    else:
+        # Ordem das colunas do STATUS_SQL. datetime vai direto: o
+        # ORJSONResponse serializa em ISO-8601
+        email_v, active_v, updated_v = row
+        result = {
+            "email": email_v,
+            "active": active_v,
+            "found": True,
+            "updated_at": updated_v,
+        }
+
+    await cache_set(email, result)
+    return result
 
 
 # =========================
 # TOKEN VALIDATION
 # =========================
+def _token_matches(candidate: str) -> bool:
+    # Comparação em tempo constante (sem timing side-channel)
+    return hmac.compare_digest(candidate.encode(), WEBHOOK_TOKEN_B)
+
+
 def token_ok(request: Request) -> bool:
     """
     Aceita token vindo de:
@@ -105,17 +508,19 @@ def token_ok(request: Request) -> bool:
         return True
 
     qs_sigs = [s.strip() for s in request.query_params.getlist("signature") if s]
-    if qs_sigs and WEBHOOK_TOKEN in qs_sigs:
+    if any(_token_matches(s) for s in qs_sigs):
         return True
 
-    hdr_sig = (request.headers.get("X-Webhook-Token", "") or "").strip()
-    if hdr_sig == WEBHOOK_TOKEN:
+    headers = request.headers
+
+    hdr_sig = (headers.get("X-Webhook-Token", "") or "").strip()
+    if _token_matches(hdr_sig):
         return True
 
-    hdr_auth = (request.headers.get("Authorization", "") or "").strip()
+    hdr_auth = (headers.get("Authorization", "") or "").strip()
     if hdr_auth.lower().startswith("bearer "):
         bearer = hdr_auth.split(" ", 1)[1].strip()
-        if bearer == WEBHOOK_TOKEN:
+        if _token_matches(bearer):
             return True
 
     return False
@@ -124,137 +529,149 @@ def token_ok(request: Request) -> bool:
 # =========================
 # HELPERS
 # =========================
+_EMAIL_PATHS = (
+    ("customer", "email"),
+    ("Customer", "email"),  # <- Kiwify real no seu log
+    ("buyer", "email"),
+    ("order", "customer", "email"),
+    ("order", "customer_email"),
+    ("customer_email",),
+    ("customerEmail",),
+    ("email",),
+    ("data", "customer", "email"),
+    ("data", "Customer", "email"),
+)
+
+
 def pick_email(data: dict) -> str:
     """
     Procura o email em vários lugares possíveis do payload (incluindo 'Customer' com C maiúsculo).
     """
-    paths = [
-        ["customer", "email"],
-        ["Customer", "email"],  # <- Kiwify real no seu log
-        ["buyer", "email"],
-        ["order", "customer", "email"],
-        ["order", "customer_email"],
-        ["customer_email"],
-        ["customerEmail"],
-        ["email"],
-        ["data", "customer", "email"],
-        ["data", "Customer", "email"],
-    ]
-
-    for path in paths:
+    for path in _EMAIL_PATHS:
         ref = data
-        for key in path:
-            if isinstance(ref, dict):
-                ref = ref.get(key)
-            else:
-                ref = None
+        try:
+            for key in path:
+                ref = ref[key]
+        except (KeyError, TypeError):
+            continue
         if isinstance(ref, str) and "@" in ref:
             return ref.strip().lower()
 
     return ""
 
 
+# Eventos ativos/inativos (já adaptados ao seu payload)
+ACTIVE_EVENTS = frozenset({
+    "compra_aprovada",
+    "purchase_approved",
+    "approved",
+    "subscription_renewed",
+    "assinatura_renovada",
+    "order_approved",  # <- Kiwify real no seu log
+    "paid",            # <- fallback possível
+})
+
+INACTIVE_EVENTS = frozenset({
+    "subscription_canceled",
+    "assinatura_cancelada",
+    "subscription_late",
+    "chargeback",
+    "refund",
+    "reembolso",
+    "canceled",
+    "refunded",
+})
+
+# evento -> novo valor de `active` (eventos fora daqui são ignorados)
+_EVENT_TO_ACTIVE = {e: True for e in ACTIVE_EVENTS} | {e: False for e in INACTIVE_EVENTS}
+
+_EVENT_KEYS = (
+    "event",
+    "type",
+    "evento",
+    "Event",
+    "name",
+    "webhook_event_type",   # <- Kiwify real no seu log
+    "order_status",         # <- fallback (ex: paid)
+)
+
+
 def normalize_event(data: dict) -> str:
     """
     No seu payload real, o evento vem em 'webhook_event_type' (ex: order_approved).
     """
-    ev = (
-        data.get("event")
-        or data.get("type")
-        or data.get("evento")
-        or data.get("Event")
-        or data.get("name")
-        or data.get("webhook_event_type")   # <- Kiwify real no seu log
-        or data.get("order_status")         # <- fallback (ex: paid)
-        or ""
-    )
+    for key in _EVENT_KEYS:
+        ev = data.get(key)
+        if ev:
+            break
+    else:
+        ev = ""
+    # Kiwify já manda normalizado (ex: order_approved): evento conhecido nem
+    # passa pelo strip/lower/replace
+    if isinstance(ev, str) and ev in _EVENT_TO_ACTIVE:
+        return ev
     return str(ev).strip().lower().replace(" ", "_")
 
 
+# Só as chaves de topo que pick_email/normalize_event consultam, geradas das
+# tabelas acima (chave nova lá entra aqui sozinha). O resto do JSON (produto,
+# comissões, tracking...) é pulado pelo decoder sem virar objeto Python.
+_PAYLOAD_FIELDS = tuple(dict.fromkeys(_EVENT_KEYS + tuple(p[0] for p in _EMAIL_PATHS)))
+
+KiwifyPayload = msgspec.defstruct(
+    "KiwifyPayload", [(field, Any, None) for field in _PAYLOAD_FIELDS]
+)
+
+
 # =========================
 # WEBHOOK
 # =========================
 @app.post("/webhook/kiwify")
-async def kiwify_webhook(request: Request):
+async def kiwify_webhook(request: Request, get_conn=Depends(db)):
 
     if not token_ok(request):
         raise HTTPException(status_code=401, detail="Invalid webhook token")
 
+    body = await request.body()
     try:
-        data = await request.json()
-    except Exception:
+        payload = msgspec.json.decode(body, type=KiwifyPayload)
+    except msgspec.DecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
-    # Debug leve
-    print("[KIWIFY] keys:", list(data.keys()))
-    print("[KIWIFY] preview:", str(data)[:900])
+    data = msgspec.structs.asdict(payload)
+
+    # Debug (só monta o preview com LOG_LEVEL=DEBUG)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("keys: %s", list(orjson.loads(body)))
+        logger.debug("preview: %s", body[:900].decode(errors="replace"))
 
     event = normalize_event(data)
     email = pick_email(data)
 
-    # Auditoria: salva sempre o payload
-    conn = get_conn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                "INSERT INTO webhook_events (event, email, raw) VALUES (%s, %s, %s)",
-                (event or None, email or None, json.dumps(data)),
-            )
-            conn.commit()
-    finally:
-        conn.close()
+    new_active = _EVENT_TO_ACTIVE.get(event)
+
+    # Auditoria: salva sempre o payload (o body cru, sem re-serializar). Quando
+    # o evento mexe na assinatura ela vai junto com o upsert; senão vai pra
+    # fila e é gravada em lote.
+    if email and new_active is not None:
+        conn = await get_conn()
+        await conn.execute(AUDIT_UPSERT_SQL, event or None, email, body, new_active)
+    else:
+        await enqueue_audit(event, email, body)
 
     if not email:
-        print("[KIWIFY] Recebido sem email. event=", event)
-        print("[KIWIFY] payload:", str(data)[:1500])
+        logger.info("Recebido sem email. event=%s", event)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("payload: %s", body[:1500].decode(errors="replace"))
         return {"received": True, "note": "no email", "event": event}
 
-    # Eventos ativos/inativos (já adaptados ao seu payload)
-    active_events = {
-        "compra_aprovada",
-        "purchase_approved",
-        "approved",
-        "subscription_renewed",
-        "assinatura_renovada",
-        "order_approved",  # <- Kiwify real no seu log
-        "paid",            # <- fallback possível
-    }
-
-    inactive_events = {
-        "subscription_canceled",
-        "assinatura_cancelada",
-        "subscription_late",
-        "chargeback",
-        "refund",
-        "reembolso",
-        "canceled",
-        "refunded",
-    }
-
-    new_active = None
-    if event in active_events:
-        new_active = True
-    elif event in inactive_events:
-        new_active = False
-    else:
-        print(f"[KIWIFY] Evento ignorado: {event} | email={email}")
+    if new_active is None:
+        logger.info("Evento ignorado: %s | email=%s", event, email)
         return {"received": True, "note": f"ignored event: {event}", "email": email}
 
-    # Salvar assinatura
-    conn = get_conn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO subscriptions (email, active, updated_at)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (email)
-                DO UPDATE SET active=EXCLUDED.active, updated_at=EXCLUDED.updated_at
-            """, (email, new_active, datetime.utcnow()))
-            conn.commit()
-    finally:
-        conn.close()
+    await cache_drop(email)
 
-    print(f"[KIWIFY] OK: {email} -> active={new_active} (event={event})")
+    logger.info("OK: %s -> active=%s (event=%s)", email, new_active, event)
 
     return {
         "received": True,
@@ -262,3 +679,24 @@ async def kiwify_webhook(request: Request):
         "active": new_active,
         "event": event
     }
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["migrate"]:
+        asyncio.run(migrate())
+        sys.exit(0)
+
+    import uvicorn
+
+    # Mesmo que: uvicorn main:app --loop uvloop --http httptools --workers N
+    #            --backlog 2048 --limit-concurrency 1000
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+        workers=WEB_CONCURRENCY,
+        backlog=2048,
+        limit_concurrency=1000,
+    )
@@ -0,0 +1,18 @@
+-- Schema inicial. Mantém o IF NOT EXISTS: bancos criados antes do
+-- schema_migrations já têm as tabelas e recebem esta migration uma vez.
+-- Aplicada pelo start.sh (`python main.py migrate`) antes de subir a API.
+
+CREATE TABLE IF NOT EXISTS subscriptions (
+    email TEXT PRIMARY KEY,
+    active BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Auditoria dos webhooks pra debug
+CREATE TABLE IF NOT EXISTS webhook_events (
+    id SERIAL PRIMARY KEY,
+    received_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    event TEXT,
+    email TEXT,
+    raw JSONB
+);
\ No newline at end of file
@@ -0,0 +1,22 @@
+-- migrate: no-transaction
+-- Índices da webhook_events com CONCURRENTLY: o build não trava os INSERTs
+-- do webhook durante o deploy. CONCURRENTLY não roda dentro de transação, então
+-- o migrate executa este arquivo statement por statement, sem BEGIN.
+--
+-- Build concorrente que falha deixa o índice INVALID, e o IF NOT EXISTS pularia
+-- ele na próxima rodada: cada índice é dropado
+-- (também sem travar escrita) antes de criar.
+
+DROP INDEX CONCURRENTLY IF EXISTS ix_whevents_email_time;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_whevents_email_time
+    ON webhook_events (email, received_at DESC);
+
+DROP INDEX CONCURRENTLY IF EXISTS ix_whevents_event;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_whevents_event
+    ON webhook_events (event);
+
+-- Tabela só recebe INSERT em ordem de tempo: BRIN fica minúsculo e
+-- atende range/retention por received_at
+DROP INDEX CONCURRENTLY IF EXISTS ix_whevents_received_brin;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_whevents_received_brin
+    ON webhook_events USING BRIN (received_at);
@@ -0,0 +1,11 @@
+#!/bin/sh
+# Comando de start do deploy: aplica as migrations e só então sobe a API.
+# Sem isso um banco novo não tem as tabelas e o startup falha.
+#   DATABASE_URL        obrigatório
+#   WEB_CONCURRENCY     workers do uvicorn (default 2)
+#   DB_MAX_CONNECTIONS  conexões no total, divididas entre os workers (default 40)
+set -e
+
+cd "$(dirname "$0")"
+python main.py migrate
+exec python main.py